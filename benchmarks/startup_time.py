@@ -0,0 +1,118 @@
+"""
+Measure how long run_scraper.py takes to get ready before the first request goes out.
+
+Each sample runs a fresh interpreter (like a fresh container does) that imports what
+run_scraper.py imports, builds the CrawlerProcess and creates the zillow_spider crawler,
+with -X importtime enabled. Prints the wall time of every sample and the slowest imports
+of the last one.
+
+-X importtime only exists from Python 3.7, older interpreters (like the python:3.6 image)
+silently ignore it. There the breakdown falls back to the time of each startup step, the
+scrapy imports first, then building the CrawlerProcess and creating the crawler.
+
+Usage: python benchmarks/startup_time.py [--runs 5] [--top 20]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_STEPS = [
+    ('import scrapy.crawler', 'from scrapy.crawler import CrawlerProcess'),
+    ('import scrapy.utils.project', 'from scrapy.utils.project import get_project_settings'),
+    ('CrawlerProcess', 'process = CrawlerProcess(get_project_settings())'),
+    ('create_crawler', "crawler = process.create_crawler('zillow_spider')"),
+]
+STARTUP_CODE = '\n'.join(code for _, code in STARTUP_STEPS)
+
+# Without -X importtime, time each startup step and report it like an import line
+STEP_PREFIX = 'startup step:'
+TIMED_STARTUP_CODE = """
+import sys, time
+for label, code in {!r}:
+    started = time.time()
+    exec(code)
+    sys.stderr.write('{} {{}} | {{}}\\n'.format(int((time.time() - started) * 1e6), label))
+""".format(STARTUP_STEPS, STEP_PREFIX)
+HAS_IMPORTTIME = sys.version_info >= (3, 7)
+
+p = argparse.ArgumentParser()
+p.add_argument('--runs', dest='runs', type=int, default=5)
+p.add_argument('--top', dest='top', type=int, default=20, help='Number of slowest imports to show')
+
+
+def run_once():
+    started = time.time()
+    if HAS_IMPORTTIME:
+        command = [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE]
+    else:
+        command = [sys.executable, '-c', TIMED_STARTUP_CODE]
+    result = subprocess.run(
+        command,
+        cwd=PROJECT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    return time.time() - started, result.stderr
+
+
+def parse_importtime(output):
+    # Lines look like "import time:   self [us] | cumulative | imported package"
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()[1:]))  # keep nesting indent only
+    return imports
+
+
+def parse_steps(output):
+    steps = []
+    for line in output.splitlines():
+        if line.startswith(STEP_PREFIX):
+            us, label = line[len(STEP_PREFIX):].split('|')
+            steps.append((label.strip(), int(us)))
+    return steps
+
+
+def top_level_packages(imports):
+    # Cumulative time of each top level package, nested imports are already included
+    totals = {}
+    for cumulative_us, _, name in imports:
+        if name == name.lstrip():  # not indented, imported directly by the startup code
+            package = name.split('.')[0]
+            totals[package] = totals.get(package, 0) + cumulative_us
+    return sorted(totals.items(), key=lambda total: total[1], reverse=True)
+
+
+def main(args):
+    timings = []
+    for n in range(args.runs):
+        elapsed, output = run_once()
+        timings.append(elapsed)
+        print("Run {}: {:.3f}s".format(n + 1, elapsed))
+    print("Startup median {:.3f}s, min {:.3f}s, max {:.3f}s".format(
+        statistics.median(timings), min(timings), max(timings)))
+
+    if not HAS_IMPORTTIME:
+        print("\n-X importtime needs Python 3.7+, this is {}.{}: showing the time of each startup step".format(
+            *sys.version_info[:2]))
+        for label, us in parse_steps(output):
+            print("{:>10.1f} ms  {}".format(us / 1000.0, label))
+        return
+
+    imports = parse_importtime(output)
+    print("\nImport time by top level package:")
+    for package, cumulative_us in top_level_packages(imports):
+        print("{:>10.1f} ms  {}".format(cumulative_us / 1000.0, package))
+
+    print("\nSlowest {} imports (cumulative):".format(args.top))
+    for cumulative_us, self_us, name in sorted(imports, reverse=True)[:args.top]:
+        print("{:>10.1f} ms  {:>8.1f} ms self  {}".format(cumulative_us / 1000.0, self_us / 1000.0, name.strip()))
+
+
+if __name__ == '__main__':
+    main(p.parse_args())
@@ -0,0 +1,179 @@
+"""
+Local mock of the ProxyCrawl API serving synthetic Zillow pages, for load tests without proxy credits.
+
+Requests are answered like ProxyCrawl does, the Zillow url being in the "url" query parameter:
+- search results pages with the "Page" pagination links and article.list-card listings
+- home details pages with the markup parsed by ZillowSpider.parse_home_details
+
+Each response is delayed according to a latency distribution, and a share of them can fail
+with an HTTP error or carry Zillow's "error retrieving data" banner.
+
+Usage: python loadtest/mock_server.py --port 8999 --pages 5 --cards 40 --latency lognormal:0.3:0.5
+"""
+import argparse
+import math
+import random
+import re
+import sys
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+ERROR_TEXT = "There was an error retrieving some of the data for this home"
+
+p = argparse.ArgumentParser()
+p.add_argument('--port', dest='port', type=int, default=0, help='0 picks a free port, printed on startup')
+p.add_argument('--pages', dest='pages', type=int, default=5, help='Number of search results pages')
+p.add_argument('--cards', dest='cards', type=int, default=40, help='Listings per results page')
+p.add_argument('--latency', dest='latency', default='lognormal:0.3:0.5',
+               help='fixed:SECONDS, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA')
+p.add_argument('--error-rate', dest='error_rate', type=float, default=0.02,
+               help='Share of responses failing with an HTTP 500')
+p.add_argument('--banner-rate', dest='banner_rate', type=float, default=0.02,
+               help='Share of home details pages with the "error retrieving data" banner')
+p.add_argument('--padding-kb', dest='padding_kb', type=int, default=200,
+               help='Filler markup added to every page, to get close to the size of real pages')
+p.add_argument('--seed', dest='seed', type=int, default=None)
+
+
+def latency_sampler(spec):
+    """Function returning response delays in seconds, from a "distribution:param:param" spec"""
+    name, _, params = spec.partition(':')
+    params = [float(param) for param in params.split(':')] if params else []
+    if name == 'fixed':
+        return lambda: params[0]
+    if name == 'uniform':
+        return lambda: random.uniform(params[0], params[1])
+    if name == 'lognormal':
+        return lambda: random.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError("Unknown latency distribution: {}".format(spec))
+
+
+def zpid(page, n, cards):
+    return 10000000 + (page - 1) * cards + n
+
+
+def results_page(page, options, padding):
+    pagination = ['<a aria-label="Page {0}" href="/homes/for_sale/{1}">{0}</a>'.format(
+        n, '' if n == 1 else '{}_p/'.format(n)) for n in range(1, options.pages + 1)]
+    if options.pages > 1:
+        pagination.append('<a aria-label="NEXT Page" href="/homes/for_sale/{}_p/">&gt;</a>'.format(
+            min(page + 1, options.pages)))
+    cards = []
+    for n in range(options.cards):
+        home_id = zpid(page, n, options.cards)
+        cards.append(
+            '<li><article class="list-card">'
+            '<a class="list-card-link" href="https://www.zillow.com/homedetails/{0}-Mock-St-Springfield-IL-{1}/{0}_zpid/">'
+            '<address class="list-card-addr">{0} Mock St, Springfield, IL {1}</address></a>'
+            '<div class="list-card-price">${2:,}</div>'
+            '<div class="list-card-type">House for sale</div>'
+            '<ul class="list-card-details"><li>{3} bds</li><li>{4} ba</li><li>{5:,} sqft</li></ul>'
+            '</article></li>'.format(
+                home_id, 62701 + home_id % 20, 100000 + home_id % 900 * 1000,
+                1 + home_id % 5, 1 + home_id % 3, 800 + home_id % 40 * 50)
+        )
+    return (
+        '<html><body><ul class="photo-cards">{}</ul><nav>{}</nav>{}</body></html>'.format(
+            ''.join(cards), ''.join(pagination), padding)
+    )
+
+
+def cost_row(label, value):
+    return ('<div class="sc-1b8bq6y-4"><div><div><div><div><span>{}</span><span>{}</span>'
+            '</div></div></div></div></div>').format(label, value)
+
+
+def school_row(n, home_id):
+    return ('<div class="ds-school-row"><div><div><span class="ds-hero-headline ds-schools-display-rating">{0}'
+            '</span></div></div><div><a href="https://www.greatschools.org/illinois/springfield/{1}-School/">'
+            'School {1}</a></div></div>').format(1 + (home_id + n) % 10, home_id % 7 * 3 + n)
+
+
+def details_page(home_id, options, padding):
+    if random.random() < options.banner_rate:
+        return '<html><body><div>{}</div>{}</body></html>'.format(ERROR_TEXT, padding)
+    costs = ''.join([
+        cost_row('Principal & interest', '$1,{:03d}'.format(home_id % 1000)),
+        cost_row('Mortgage insurance', '$0'),
+        cost_row('Property taxes', '${}'.format(100 + home_id % 300)),
+        cost_row('Home insurance', '$75'),
+        cost_row('HOA fees', '${}'.format(home_id % 4 * 50) if home_id % 4 else 'N/A'),
+    ])
+    return (
+        '<html><body>'
+        '<div class="home-details-listing-provided-by"><span>Listing provided by Agent</span></div>'
+        '<div class="zsg-content-item"><div><span class="listing-field">Agent {0}</span>'
+        '<span class="listing-field">Mock Realty</span><span class="listing-field">(555) 555-{1:04d}</span>'
+        '</div></div>'
+        '<a class="ds-listing-agent-display-name" href="/profile/mock-agent-{1}/">Agent {0}</a>'
+        '<table><tr class="ds-tax-table-row"><td>2019</td><td>${2:,}</td></tr></table>'
+        '<h4 class="sc-4m29jb-0">${3:,}/mo</h4>'
+        '<div>{4}</div>'
+        '<div class="eSvINd"><div><div></div><div><div><p>${5:,}</p></div></div></div></div>'
+        '<div id="ds-rental-home-values"><div><div></div><div><div></div><div><div><p>${6:,}/mo</p>'
+        '</div></div></div></div></div>'
+        '<div>{7}</div>'
+        '{8}</body></html>'
+    ).format(
+        home_id % 50, home_id % 50, 1000 + home_id % 5000, 1500 + home_id % 2000, costs,
+        110000 + home_id % 900 * 1000, 1200 + home_id % 1000,
+        ''.join(school_row(n, home_id) for n in range(3)), padding
+    )
+
+
+class MockProxyCrawl(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, options):
+        super().__init__()
+        self.options = options
+        self.latency = latency_sampler(options.latency)
+        self.padding = '<div class="filler">{}</div>'.format('<span>mock filler</span>' * (options.padding_kb * 40))
+
+    def render_GET(self, request):
+        target = request.args.get(b'url', [request.uri])[0].decode('utf-8')
+        finished = []
+        request.notifyFinish().addBoth(finished.append)  # the client may time out and go away
+        reactor.callLater(self.latency(), self._respond, request, target, finished)
+        return server.NOT_DONE_YET
+
+    def _respond(self, request, target, finished):
+        if finished:
+            return
+        if random.random() < self.options.error_rate:
+            request.setResponseCode(500)
+            request.setHeader(b'pc_status', b'520')
+            request.write(b'')
+            request.finish()
+            return
+
+        path = urlparse(target).path
+        details = re.search(r'/(\d+)_zpid', path)
+        if details:
+            body = details_page(int(details.group(1)), self.options, self.padding)
+        else:
+            page = re.search(r'/(\d+)_p/', path)
+            body = results_page(int(page.group(1)) if page else 1, self.options, self.padding)
+        request.setHeader(b'content-type', b'text/html; charset=utf-8')
+        request.setHeader(b'pc_status', b'200')
+        request.setHeader(b'Screenshot_Url', b'https://mock.local/screenshot.jpg')
+        request.write(body.encode('utf-8'))
+        request.finish()
+
+
+def main(options):
+    if options.seed is not None:
+        random.seed(options.seed)
+    port = reactor.listenTCP(options.port, server.Site(MockProxyCrawl(options)), interface='127.0.0.1')
+    print("LISTENING {}".format(port.getHost().port))
+    sys.stdout.flush()
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main(p.parse_args())
@@ -0,0 +1,154 @@
+"""
+Run ZillowSpider against the local mock server (mock_server.py) at several concurrency levels.
+
+For each level the spider runs in a fresh process, with its ProxyCrawl requests sent to the mock,
+and reports throughput (items/s), retries (of RetryMiddleware and of the spider itself), p50/p99
+item latency (from the home details request being scheduled to the item being scraped, item
+pipelines included) and the peak memory of the crawl.
+
+Usage: python loadtest/run_loadtest.py --concurrency 4,8,16,32 --pages 5 --cards 40 --latency lognormal:0.3:0.5
+Every mock_server.py option is accepted and passed through to the mock.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MOCK_SERVER = os.path.join(PROJECT_DIR, 'loadtest', 'mock_server.py')
+RESULT_PREFIX = 'LOADTEST_RESULT '
+# Search url as the spider gets it, the pagination placeholder is filled for each results page
+ZILLOW_URL = 'https://www.zillow.com/homes/for_sale/?searchQueryState=%7B%22pagination%22:{}%7D'
+
+p = argparse.ArgumentParser()
+p.add_argument('--concurrency', dest='concurrency', default='4,8,16,32',
+               help='Comma separated CONCURRENT_REQUESTS values to test')
+p.add_argument('--feed-uri', dest='feed_uri', default=None,
+               help='Export items to this uri to include export cost, not exported by default')
+p.add_argument('-s', '--set', dest='settings', action='append', default=[], metavar='NAME=VALUE',
+               help='Scrapy setting for the crawls, e.g. -s NORMALIZATION_ENABLED=0')
+p.add_argument('--worker', dest='worker', action='store_true', default=False, help=argparse.SUPPRESS)
+p.add_argument('--port', dest='port', type=int, default=None, help=argparse.SUPPRESS)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def run_worker(args):
+    # Runs a single crawl in this process and prints its results as a json line
+    import resource
+    sys.path.insert(0, PROJECT_DIR)
+    os.chdir(PROJECT_DIR)
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    settings.setdict({
+        'PROXYCRAWL_URL': 'http://127.0.0.1:{}'.format(args.port),
+        'PROXYCRAWL_TOKEN': 'loadtest',
+        'CONCURRENT_REQUESTS': args.concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrency,  # every request goes to the mock
+        'FEED_URI': args.feed_uri,
+        'LOG_LEVEL': 'WARNING',
+    }, priority='cmdline')
+    settings.setdict(dict(setting.split('=', 1) for setting in args.settings), priority='cmdline')
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler('zillow_spider')
+
+    scheduled = {}
+    latencies = []
+    retries = {'retry_times': 0, 'spider_retries': 0}
+
+    def request_scheduled(request, spider):
+        # Retries of RetryMiddleware, and of the spider itself (error banner, HttpError in error_handler)
+        for key in retries:
+            if request.meta.get(key):
+                retries[key] += 1
+                break
+        # Home details requests carry their item, retries keep the same one and count in the latency
+        item = (request.cb_kwargs or {}).get('item')
+        if item is not None:
+            scheduled.setdefault(id(item), time.time())
+
+    def item_scraped(item, response, spider):
+        started = scheduled.get(id(item))
+        if started is not None:
+            latencies.append(time.time() - started)
+
+    crawler.signals.connect(request_scheduled, signal=signals.request_scheduled)
+    crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+
+    started = time.time()
+    process.crawl(crawler, zillow_url=ZILLOW_URL, sample_mode=False)
+    process.start()
+    elapsed = time.time() - started
+
+    stats = crawler.stats.get_stats()
+    result = {
+        'concurrency': args.concurrency,
+        'seconds': elapsed,
+        'items': len(latencies),
+        'requests': stats.get('downloader/request_count', 0),
+        'retries': sum(retries.values()),
+        'middleware_retries': retries['retry_times'],
+        'spider_retries': retries['spider_retries'],
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,  # kB on Linux
+    }
+    sys.stdout.write(RESULT_PREFIX + json.dumps(result) + '\n')
+
+
+def start_mock_server(mock_args):
+    mock = subprocess.Popen([sys.executable, MOCK_SERVER, '--port', '0'] + mock_args,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    line = mock.stdout.readline()
+    if not line.startswith('LISTENING'):
+        mock.kill()
+        raise RuntimeError("Mock server did not start: {}".format(line))
+    return mock, int(line.split()[1])
+
+
+def run_level(port, concurrency, args):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--port', str(port),
+               '--concurrency', str(concurrency)]
+    if args.feed_uri:
+        command += ['--feed-uri', args.feed_uri]
+    for setting in args.settings:
+        command += ['--set', setting]
+    # The spider prints every listing, only the result line matters here
+    output = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    for line in output.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError("No result from the crawl at concurrency {}".format(concurrency))
+
+
+def main(args, mock_args):
+    mock, port = start_mock_server(mock_args)
+    try:
+        print("{:>11} {:>8} {:>7} {:>9} {:>8} {:>9} {:>9} {:>8}".format(
+            'concurrency', 'seconds', 'items', 'items/s', 'retries', 'p50 (s)', 'p99 (s)', 'RSS MB'))
+        for concurrency in [int(level) for level in args.concurrency.split(',')]:
+            result = run_level(port, concurrency, args)
+            print("{:>11} {:>8.1f} {:>7} {:>9.1f} {:>8} {:>9.3f} {:>9.3f} {:>8.1f}".format(
+                concurrency, result['seconds'], result['items'], result['items'] / result['seconds'],
+                result['retries'], result['p50'] or 0, result['p99'] or 0, result['max_rss_mb']))
+    finally:
+        mock.terminate()
+
+
+if __name__ == '__main__':
+    args, mock_args = p.parse_known_args()
+    if args.worker:
+        args.concurrency = int(args.concurrency)
+        run_worker(args)
+    else:
+        main(args, mock_args)
@@ -0,0 +1,109 @@
+import argparse
+import json
+import multiprocessing
+
+# Runs the current ZillowSpider.parse_home_details over archived home details pages (see
+# zillow_scraper/archive.py), without any request to Zillow or ProxyCrawl, and writes the
+# items as json lines.
+p = argparse.ArgumentParser()
+p.add_argument('--archive-uri', dest='archive_uri', required=True, help='ARCHIVE_URI of the runs to reparse')
+p.add_argument('--output', dest='output', required=True, help='Json lines file receiving the items')
+p.add_argument('--since', dest='since', default=None, help='First archive date to reparse, YYYY-MM-DD')
+p.add_argument('--until', dest='until', default=None, help='Last archive date to reparse, YYYY-MM-DD')
+p.add_argument('--zpid', dest='zpids', action='append', default=[], help='Only these homes, can be repeated')
+p.add_argument('--workers', dest='workers', type=int, default=multiprocessing.cpu_count())
+p.add_argument('--chunk-size', dest='chunk_size', type=int, default=200, help='Records per worker task')
+
+# Archive file of the last task in this worker process, consecutive tasks often share it
+_archive = {}
+
+
+def _settings():
+    from scrapy.utils.project import get_project_settings
+    return get_project_settings()
+
+
+def find_runs(args, settings):
+    from zillow_scraper.storage import list_uris
+    runs = []
+    for uri in list_uris(args.archive_uri, settings):
+        if not uri.endswith('.idx.jsonl.gz'):
+            continue
+        date = uri.rstrip('/').split('/')[-2]
+        if (args.since and date < args.since) or (args.until and date > args.until):
+            continue
+        runs.append(uri[:-len('.idx.jsonl.gz')])
+    return runs
+
+
+def make_tasks(runs, args, settings):
+    from zillow_scraper.archive import read_index
+    from zillow_scraper.storage import read_bytes
+    zpids = set(args.zpids)
+    for run_uri in runs:
+        codec, entries = read_index(read_bytes(run_uri + '.idx.jsonl.gz', settings))
+        if zpids:
+            entries = [entry for entry in entries if entry['zpid'] in zpids]
+        for start in range(0, len(entries), args.chunk_size):
+            yield run_uri, codec, entries[start:start + args.chunk_size]
+
+
+def reparse_chunk(task):
+    from scrapy.http import HtmlResponse, Request
+    from zillow_scraper.archive import Codec, decode_record
+    from zillow_scraper.items import HomeItem
+    from zillow_scraper.pipelines import NormalizationPipeline
+    from zillow_scraper.spiders.zillow_spider import ZillowSpider
+    from zillow_scraper.storage import read_bytes
+
+    run_uri, codec, entries = task
+    if _archive.get('run_uri') != run_uri:
+        settings = _settings()
+        _archive.clear()
+        _archive.update(
+            run_uri=run_uri,
+            data=read_bytes(run_uri + '.arc', settings),
+            codec=Codec(codec, read_bytes(run_uri + '.dict', settings)),
+        )
+
+    items = []
+    skipped = 0
+    spiders = {}
+    normalization = NormalizationPipeline()
+    for entry in entries:
+        data = _archive['codec'].decompress(_archive['data'][entry['offset']:entry['offset'] + entry['length']])
+        record, body = decode_record(data)
+        search_url = record['search_url']
+        if search_url not in spiders:
+            spiders[search_url] = ZillowSpider(zillow_url=search_url, sample_mode=False)
+        response = HtmlResponse(record['url'], body=body, encoding='utf-8', request=Request(record['url']))
+        item = spiders[search_url].parse_home_details(response, HomeItem(record['item']))
+        if not isinstance(item, HomeItem):  # A retry, the archived page had the loading error banner
+            skipped += 1
+            continue
+        item = dict(normalization.normalize(item))
+        item['zpid'] = record['zpid']
+        item['archive_date'] = record['date']
+        items.append(item)
+    return items, skipped
+
+
+def main(args):
+    settings = _settings()
+    runs = find_runs(args, settings)
+    print("REPARSING {} ARCHIVED RUNS..".format(len(runs)))
+    count = skipped = 0
+    pool = multiprocessing.Pool(args.workers)
+    with open(args.output, 'w') as output:
+        for items, chunk_skipped in pool.imap_unordered(reparse_chunk, make_tasks(runs, args, settings)):
+            for item in items:
+                output.write(json.dumps(item, default=str) + '\n')
+            count += len(items)
+            skipped += chunk_skipped
+    pool.close()
+    pool.join()
+    print("REPARSED {} HOMES, SKIPPED {} PAGES WITH LOADING ERRORS".format(count, skipped))
+
+
+if __name__ == '__main__':
+    main(p.parse_args())
@@ -1,14 +1,106 @@
 import argparse
-from scrapy.crawler import CrawlerProcess
-from scrapy.utils.project import get_project_settings
+import logging
+import sys
+import threading
 
-# This scrapper takes arguments. At least zillow url is required
+logger = logging.getLogger(__name__)
+
+# This scrapper takes arguments. At least zillow url is required, unless urls are served from stdin
 p = argparse.ArgumentParser()
-p.add_argument('--zillow-url', dest='zillow_url', required=True)
+p.add_argument('--zillow-url', dest='zillow_urls', action='append', default=[],
+               help='Zillow search url, can be repeated to run several searches in this process')
 p.add_argument('--sample-mode', dest='sample_mode', action='store_true', default=False)
+p.add_argument('--serve', dest='serve', action='store_true', default=False,
+               help='Keep the process warm and run one search per zillow url read from stdin until EOF')
+p.add_argument('--profile', dest='profile', action='store_true', default=False,
+               help='Sample the spider callbacks and pipelines, writing a flamegraph and summary at the end')
+p.add_argument('--profile-uri', dest='profile_uri', default=None,
+               help='Where to write the profile, PROFILE_URI setting by default')
+
+
+def crawl_urls(process, urls, sample_mode, failed):
+    # Searches run one after the other, each one with its own feed file
+    from twisted.internet import defer
+
+    @defer.inlineCallbacks
+    def crawl():
+        for url in urls:
+            yield crawl_url(process, url, sample_mode, failed)
+    return crawl()
+
+
+def serve_urls(process, sample_mode, failed):
+    # Keep the loaded interpreter for every search read from stdin. A daemon thread reads it, so a
+    # thread blocked on readline never delays the reactor shutdown on SIGTERM
+    from twisted.internet import defer, reactor
+
+    lines = defer.DeferredQueue()
+
+    def read_stdin():
+        for line in iter(sys.stdin.readline, ''):
+            reactor.callFromThread(lines.put, line)
+        reactor.callFromThread(lines.put, None)  # EOF
+
+    reader = threading.Thread(target=read_stdin, name='stdin-reader')
+    reader.daemon = True
+    reader.start()
+
+    @defer.inlineCallbacks
+    def serve():
+        while True:
+            line = yield lines.get()
+            if line is None:
+                break
+            url = line.strip()
+            if url:
+                yield crawl_url(process, url, sample_mode, failed)
+    return serve()
+
+
+def crawl_url(process, url, sample_mode, failed):
+    # A failing search is logged and counted, the next searches still run
+    from twisted.internet import defer
+
+    def crawl_failed(failure):
+        failed.append(url)
+        logger.error("Search failed: {}\n{}".format(url, failure.getTraceback()))
+
+    dfd = defer.maybeDeferred(process.crawl, 'zillow_spider', zillow_url=url, sample_mode=sample_mode)
+    return dfd.addErrback(crawl_failed)
+
+
+def main(args):
+    # Scrapy is imported after parsing arguments, so usage errors don't pay for it
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    if args.profile:
+        settings.set('PROFILE_ENABLED', True, priority='cmdline')
+        if args.profile_uri:
+            settings.set('PROFILE_URI', args.profile_uri, priority='cmdline')
+    process = CrawlerProcess(settings)
+    from twisted.internet import reactor  # after CrawlerProcess, which may install its own reactor
+
+    def stop(_):
+        if reactor.running:  # Not already stopped by a shutdown signal
+            reactor.stop()
+
+    failed = []
+    if args.serve:
+        d = serve_urls(process, args.sample_mode, failed)
+    else:
+        d = crawl_urls(process, args.zillow_urls, args.sample_mode, failed)
+    d.addErrback(lambda failure: print(failure.getTraceback()))
+    d.addBoth(stop)
+    process.start(stop_after_crawl=False)
+    if failed:
+        logger.error("{} searches failed: {}".format(len(failed), ', '.join(failed)))
+    return 1 if failed else 0
+
 
 if __name__ == '__main__':
     args = p.parse_args()
-    process = CrawlerProcess(get_project_settings())
-    process.crawl('zillow_spider', **vars(args))
-    process.start()
+    if not args.zillow_urls and not args.serve:
+        p.error('--zillow-url is required unless --serve is used')
+    sys.exit(main(args))
@@ -0,0 +1,136 @@
+import pytest
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, threads
+
+from zillow_scraper.items import HomeItem
+from zillow_scraper.pipelines import ChangeCapturePipeline, EnrichmentPipeline, parse_number
+
+
+@pytest.mark.parametrize('value, expected', [
+    (3, 3.0),
+    ('$1,250,000', 1250000.0),
+    ('$2.1M', 2100000.0),
+    ('$850K', 850000.0),
+    ('$1.5k', 1500.0),
+    ('$250/mo', 250.0),
+    ('$1,234/mo', 1234.0),
+    ('7/10', 7.0),
+    ('3 bds', 3.0),
+    ('2.5 ba', 2.5),
+    ('1,500 sqft', 1500.0),
+    ('1,500sqft', 1500.0),
+    ('0.28 acres lot', 12196.8),
+    ('1 acre lot', 43560.0),
+    ('.5 acres', 21780.0),
+])
+def test_parse_number(value, expected):
+    assert parse_number(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('value', [None, '', '--', 'Not rated'])
+def test_parse_number_without_number(value):
+    assert parse_number(value) is None
+
+
+class FakeSpider(object):
+    sample_mode = False
+
+
+def home(zpid, price='$300,000', provided_by='agent', **fields):
+    link = 'https://www.zillow.com/homedetails/{0}-Main-St/{0}_zpid/'.format(zpid)
+    return HomeItem(home_details_link=link, price=price, listing_provided_by=provided_by, **fields)
+
+
+def change_capture_run(tmp_path, items):
+    """Run a finished crawl of items through ChangeCapturePipeline, return its changes and stats"""
+    crawler = get_crawler(settings_dict={
+        'CHANGE_CAPTURE_ENABLED': True,
+        'CHANGE_CAPTURE_STATE_URI': str(tmp_path / 'state.json.gz'),
+        'CHANGE_CAPTURE_URI': str(tmp_path / 'changes.jsonl.gz'),
+        'FEED_EXPORT_FIELDS': ['home_details_link', 'price', 'listing_provided_by'],
+    })
+    crawler.stats.set_value('zillow/pages', 1)
+    crawler.stats.set_value('zillow/results_pages', 1)
+    pipeline = ChangeCapturePipeline.from_crawler(crawler)
+    pipeline._load_state()
+    for item in items:
+        pipeline.process_item(item, FakeSpider())
+    pipeline.spider_idle(FakeSpider())
+    pipeline.close_spider(FakeSpider())
+    return [(change['change'], change['zpid']) for change in pipeline.changes], crawler.stats
+
+
+@pytest.fixture
+def sync_threads(monkeypatch):
+    # Store the state right away, there is no reactor running the thread pool
+    monkeypatch.setattr(threads, 'deferToThread', lambda function, *args: function(*args))
+
+
+def test_change_capture_budget_skipped_details(tmp_path, sync_threads):
+    change_capture_run(tmp_path, [home(1), home(2)])
+
+    # Details of listing 2 skipped by the credit budget: not changed, not removed
+    changes, stats = change_capture_run(tmp_path, [home(1), home(2, provided_by=None, details_skipped=True)])
+    assert changes == []
+    assert stats.get_value('changecapture/details_skipped') == 1
+    assert stats.get_value('changecapture/carried_forward') == 1
+
+    # Its previous fingerprint was kept, so the next full run sees no change either
+    changes, _ = change_capture_run(tmp_path, [home(1), home(2)])
+    assert changes == []
+
+    changes, _ = change_capture_run(tmp_path, [home(1, price='$290,000')])
+    assert sorted(changes) == [('changed', '1'), ('removed', '2')]
+
+
+class FakeEngine(object):
+    """Answers engine.download with the next (status, pc_status) of statuses"""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.downloads = 0
+
+    def download(self, request, spider=None):
+        self.downloads += 1
+        status, pc_status = self.statuses.pop(0)
+        body = b'<html><head><title>Springfield Elementary</title></head></html>'
+        return defer.succeed(HtmlResponse(request.url, status=status, headers={'pc_status': pc_status}, body=body))
+
+
+class FakeEnrichmentSpider(object):
+    BASE_URL = 'https://www.zillow.com'
+
+    def _get_random_user_agent(self):
+        return 'test'
+
+
+def enrich(pipeline, link='/school/springfield-elementary/'):
+    results = []
+    dfd = defer.maybeDeferred(pipeline.process_item, HomeItem(elementary_school_link=link), FakeEnrichmentSpider())
+    dfd.addCallback(results.append)
+    return results[0]['elementary_school_details']
+
+
+def test_enrichment_retries_failed_pages(tmp_path):
+    crawler = get_crawler(settings_dict={'ENRICHMENT_ENABLED': True, 'ENRICHMENT_MAX_FAILURES': 3,
+                                         'ENRICHMENT_CACHE_URI': str(tmp_path / 'cache.json.gz')})
+    crawler.engine = FakeEngine([(503, '200'), (200, '520'), (200, '200')])
+    pipeline = EnrichmentPipeline.from_crawler(crawler)
+
+    assert enrich(pipeline) is None  # HTTP error
+    assert enrich(pipeline) is None  # ProxyCrawl error, still fetched again
+    assert enrich(pipeline)['title'] == 'Springfield Elementary'
+    assert enrich(pipeline)['title'] == 'Springfield Elementary'  # Cached
+    assert crawler.engine.downloads == 3
+
+    crawler.engine = FakeEngine([(503, '200')] * 3)
+    for _ in range(4):
+        assert enrich(pipeline, '/school/shelbyville/') is None
+    assert crawler.engine.downloads == 3  # Gave up after ENRICHMENT_MAX_FAILURES
+
+    # Failures are not persisted, the next run fetches them again
+    pipeline._store_cache()
+    next_run = EnrichmentPipeline.from_crawler(crawler)
+    next_run._load_cache()
+    assert list(next_run.cache) == ['https://www.zillow.com/school/springfield-elementary/']
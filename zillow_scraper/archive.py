@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# Archive of the raw home details pages, to parse them again without fetching them
+#
+# Each run writes three files under ARCHIVE_URI/<date>/:
+# - <run>.arc: the compressed records, one after the other
+# - <run>.idx.jsonl.gz: the codec, then one line per record with its zpid, url, date, offset and length
+# - <run>.dict: the compression dictionary of the run
+#
+# Zillow pages of a search share most of their markup, so records are compressed with zstd and a
+# dictionary trained on the first pages of the run. Archives compressed with zlib and a preset
+# dictionary can still be read, with or without the zstandard package.
+#
+# See reparse.py to run the current parse_home_details over archived pages.
+
+import gzip
+import json
+import logging
+import tempfile
+import zlib
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import threads
+
+from zillow_scraper.pipelines import get_zpid
+from zillow_scraper.storage import uri_params, write_bytes, write_file
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+def train_dictionary(samples, size):
+    """Return (codec, dictionary) for the sample records"""
+    try:
+        return 'zstd', zstandard.train_dictionary(size, samples).as_bytes()
+    except zstandard.ZstdError:
+        # Too few samples to train, the start of a page makes a fine raw content dictionary
+        return 'zstd', samples[0][:size]
+
+
+class Codec(object):
+
+    def __init__(self, codec, dictionary):
+        self.codec = codec
+        self.dictionary = dictionary
+        if codec == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("The zstandard package is required to read zstd archives")
+            dict_data = zstandard.ZstdCompressionDict(dictionary)
+            self.compressor = zstandard.ZstdCompressor(level=9, dict_data=dict_data)
+            self.decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+
+    def compress(self, data):
+        if self.codec == 'zstd':
+            return self.compressor.compress(data)
+        compressor = zlib.compressobj(9, zdict=self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        if self.codec == 'zstd':
+            return self.decompressor.decompress(data)
+        decompressor = zlib.decompressobj(zdict=self.dictionary)
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+def encode_record(record, body):
+    # Record metadata as a json line, followed by the raw page
+    return json.dumps(record).encode('utf-8') + b'\n' + body
+
+
+def decode_record(data):
+    meta, _, body = data.partition(b'\n')
+    return json.loads(meta.decode('utf-8')), body
+
+
+def read_index(data):
+    """Return (codec, entries) of an index file content"""
+    lines = gzip.decompress(data).decode('utf-8').splitlines()
+    return json.loads(lines[0])['codec'], [json.loads(line) for line in lines[1:]]
+
+
+class ResponseArchive(object):
+    """Extension archiving every home details page received, with the listing data it was requested with"""
+
+    def __init__(self, crawler):
+        self.settings = crawler.settings
+        self.stats = crawler.stats
+        self.archive_uri = self.settings.get('ARCHIVE_URI').rstrip('/')
+        self.dictionary_samples = self.settings.getint('ARCHIVE_DICTIONARY_SAMPLES', 32)
+        self.dictionary_size = self.settings.getint('ARCHIVE_DICTIONARY_SIZE', 112640)
+        self.codec = None
+        self.samples = []  # records waiting for the dictionary to be trained
+        self.index = []
+        self.file = None
+        self.run_uri = None
+        self.date = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ARCHIVE_ENABLED'):
+            raise NotConfigured
+        if zstandard is None:
+            raise NotConfigured("The zstandard package is required to archive pages")
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        params = uri_params(spider)
+        self.date = params['time'][:10]
+        self.run_uri = '{}/{}/{}'.format(self.archive_uri, self.date, '%(time)s_%(name)s_%(search)s' % params)
+        self.file = tempfile.TemporaryFile()
+
+    def response_received(self, response, request, spider):
+        if getattr(request.callback, '__name__', None) != 'parse_home_details' or response.status != 200:
+            return
+        item = request.cb_kwargs['item']
+        record = {
+            'zpid': get_zpid(item),
+            'url': response.url,
+            'date': self.date,
+            'search_url': spider.zillow_url,
+            'item': dict(item),
+        }
+        self.samples.append((record, encode_record(record, response.body)))
+        if self.codec is None and len(self.samples) < self.dictionary_samples:
+            return
+        self._write_samples()
+
+    def _write_samples(self):
+        if self.codec is None:
+            self.codec = Codec(*train_dictionary([data for _, data in self.samples], self.dictionary_size))
+        for record, data in self.samples:
+            compressed = self.codec.compress(data)
+            self.index.append({
+                'zpid': record['zpid'],
+                'url': record['url'],
+                'date': record['date'],
+                'offset': self.file.tell(),
+                'length': len(compressed),
+            })
+            self.file.write(compressed)
+            self.stats.inc_value('archive/records')
+            self.stats.inc_value('archive/bytes', len(data))
+            self.stats.inc_value('archive/compressed_bytes', len(compressed))
+        self.samples = []
+
+    def spider_closed(self, spider):
+        if self.samples:
+            self._write_samples()
+        if not self.index:
+            self.file.close()
+            return
+        return threads.deferToThread(self._store)
+
+    def _store(self):
+        # Index last, runs are found by their index so they are never read half written
+        write_bytes(self.run_uri + '.dict', self.codec.dictionary, self.settings)
+        write_file(self.run_uri + '.arc', self.file, self.settings)
+        self.file.close()
+        lines = [json.dumps({'codec': self.codec.codec})] + [json.dumps(entry) for entry in self.index]
+        write_bytes(self.run_uri + '.idx.jsonl.gz', gzip.compress('\n'.join(lines).encode('utf-8')), self.settings)
+        logger.info("Archived {} home details pages in {}.arc".format(len(self.index), self.run_uri))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# Feed exporters and storages that defer their heavy imports
+#
+# Each run_scraper.py container serves a single short search, so anything loaded before the
+# first request goes out is paid on every run. openpyxl and botocore are only needed once
+# items are exported and the feed is stored, so they are imported at that point instead.
+#
+# See: https://docs.scrapy.org/en/latest/topics/feed-exports.html
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+from scrapy.extensions.feedexport import BlockingFeedStorage
+
+
+class LazyXlsxItemExporter(object):
+    """Wraps scrapy_xlsx.XlsxItemExporter, importing it (and openpyxl) on the first exported item"""
+
+    def __init__(self, file, **kwargs):
+        self.file = file
+        self.kwargs = kwargs
+        self._exporter = None
+
+    @property
+    def exporter(self):
+        if self._exporter is None:
+            from scrapy_xlsx import XlsxItemExporter
+            self._exporter = XlsxItemExporter(self.file, **self.kwargs)
+            self._exporter.start_exporting()
+        return self._exporter
+
+    def start_exporting(self):
+        pass  # Started together with the real exporter
+
+    def export_item(self, item):
+        return self.exporter.export_item(item)
+
+    def finish_exporting(self):
+        self.exporter.finish_exporting()
+
+
+class LazyS3FeedStorage(BlockingFeedStorage):
+    """S3 feed storage creating its botocore client when the feed is stored, not when the spider opens"""
+
+    def __init__(self, uri, access_key=None, secret_key=None, acl=None):
+        u = urlparse(uri)
+        self.bucketname = u.hostname
+        self.access_key = u.username or access_key
+        self.secret_key = u.password or secret_key
+        self.keyname = u.path[1:]  # remove first "/"
+        self.acl = acl
+
+    @classmethod
+    def from_crawler(cls, crawler, uri):
+        return cls(
+            uri,
+            access_key=crawler.settings['AWS_ACCESS_KEY_ID'],
+            secret_key=crawler.settings['AWS_SECRET_ACCESS_KEY'],
+            acl=crawler.settings['FEED_STORAGE_S3_ACL'] or None
+        )
+
+    def _store_in_thread(self, file):
+        import botocore.session
+        session = botocore.session.get_session()
+        s3_client = session.create_client(
+            's3', aws_access_key_id=self.access_key, aws_secret_access_key=self.secret_key
+        )
+        file.seek(0)
+        kwargs = {'ACL': self.acl} if self.acl else {}
+        s3_client.put_object(Bucket=self.bucketname, Key=self.keyname, Body=file, **kwargs)
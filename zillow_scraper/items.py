@@ -22,6 +22,7 @@ class HomeItem(scrapy.Item):
     listing_provided_by = scrapy.Field()
     listing_provider_name = scrapy.Field()
     listing_provider_phone = scrapy.Field()
+    listing_provider_link = scrapy.Field()
     property_taxes_last_year = scrapy.Field()
     estimated_monthly_cost = scrapy.Field()
     property_taxes_monthly = scrapy.Field()
@@ -38,3 +39,26 @@ class HomeItem(scrapy.Item):
     high_school_rating = scrapy.Field()
     high_school_link = scrapy.Field()
 
+    # Typed values parsed from the display strings above, see pipelines.NormalizationPipeline
+    price_value = scrapy.Field()
+    number_of_bedrooms_value = scrapy.Field()
+    number_of_bathrooms_value = scrapy.Field()
+    sqft_value = scrapy.Field()
+    property_taxes_last_year_value = scrapy.Field()
+    estimated_monthly_cost_value = scrapy.Field()
+    property_taxes_monthly_value = scrapy.Field()
+    hoa_fees_value = scrapy.Field()
+    zestimate_sell_price_value = scrapy.Field()
+    zestimate_rent_price_value = scrapy.Field()
+    elementary_school_rating_value = scrapy.Field()
+    middle_school_rating_value = scrapy.Field()
+    high_school_rating_value = scrapy.Field()
+
+    # Details of the agent and school pages, see pipelines.EnrichmentPipeline
+    listing_provider_details = scrapy.Field()
+    elementary_school_details = scrapy.Field()
+    middle_school_details = scrapy.Field()
+    high_school_details = scrapy.Field()
+
+    # Not exported: set when the credit budget skipped the home details, the item only has the listing card data
+    details_skipped = scrapy.Field()
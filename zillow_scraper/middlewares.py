@@ -5,7 +5,24 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import logging
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+from scrapy_proxycrawl import ProxyCrawlMiddleware as BaseProxyCrawlMiddleware, ProxyCrawlRequest
+
+logger = logging.getLogger(__name__)
+
+# Spider callback -> type of request, for the credits accounting
+REQUEST_TYPES = {
+    'parse': 'search',
+    'parse_listing_page': 'results_page',
+    'parse_home_details': 'details_page',
+}
+
+
+class BudgetSkippedRequest(IgnoreRequest):
+    """A request not sent to stay within PROXYCRAWL_CREDIT_BUDGET"""
 
 
 class ZillowScraperSpiderMiddleware(object):
@@ -101,3 +118,116 @@ class ZillowScraperDownloaderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class ProxyCrawlMiddleware(BaseProxyCrawlMiddleware):
+    # Same as scrapy_proxycrawl's middleware, but the API url can be changed with
+    # the PROXYCRAWL_URL setting, e.g. to point to the local mock of the load tests
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.proxycrawl_url = settings.get('PROXYCRAWL_URL') or self.proxycrawl_url
+
+
+class ProxyCrawlCostMiddleware(object):
+    # Counts the ProxyCrawl credits spent by the run per type of request (search, results page,
+    # details page, retry) and projects the cost of the whole run from the number of results pages
+    # and listing cards found by the spider.
+    #
+    # With a PROXYCRAWL_CREDIT_BUDGET, the crawl is degraded step by step as the budget is spent
+    # (see PROXYCRAWL_BUDGET_STEPS), and the spider is closed once it is exhausted. Listings whose
+    # details are skipped are still scraped, with the data of their listing card only.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.request_credits = settings.getfloat('PROXYCRAWL_CREDITS_PER_REQUEST', 1)
+        self.javascript_credits = settings.getfloat('PROXYCRAWL_CREDITS_JAVASCRIPT', 0)
+        self.screenshot_credits = settings.getfloat('PROXYCRAWL_CREDITS_SCREENSHOT', 0)
+        self.budget = settings.getfloat('PROXYCRAWL_CREDIT_BUDGET', 0)
+        self.steps = settings.getdict('PROXYCRAWL_BUDGET_STEPS')
+        self.spent = 0
+        self.closing = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def request_type(self, request):
+        if request.meta.get('retry_times') or request.meta.get('spider_retries'):
+            return 'retry'
+        return REQUEST_TYPES.get(getattr(request.callback, '__name__', None), 'other')
+
+    def credits(self, request):
+        credits = self.request_credits
+        if request.page_wait or request.ajax_wait or request.css_click_selector:  # Javascript token
+            credits += self.javascript_credits
+        if request.screenshot:
+            credits += self.screenshot_credits
+        return credits
+
+    def projected(self):
+        # Cost of the whole run: one search, every results page and a details page per card,
+        # at the average cost of the requests so far, plus the same share of retries
+        pages = self.stats.get_value('zillow/pages')
+        results_pages = self.stats.get_value('zillow/results_pages')
+        if not pages or not results_pages:
+            return self.spent
+        cards = self.stats.get_value('zillow/cards', 0) * pages / float(results_pages)
+        requests = self.stats.get_value('proxycrawl/requests', 0)
+        retries = self.stats.get_value('proxycrawl/requests/retry', 0)
+        first_attempts = requests - retries
+        if not first_attempts:
+            return self.spent
+        average_credits = self.spent / float(requests)
+        retry_ratio = retries / float(first_attempts)
+        return max(self.spent, (1 + pages + cards) * average_credits * (1 + retry_ratio))
+
+    def degraded(self, step):
+        if not self.budget:
+            return False
+        if step == 'no_screenshots' and self.projected() > self.budget:
+            return True  # Cheapest degradation, applied as soon as the run is expected to go over budget
+        return self.spent >= self.budget * self.steps.get(step, 1)
+
+    def process_request(self, request, spider):
+        if not isinstance(request, ProxyCrawlRequest):
+            return None
+        request_type = self.request_type(request)
+        if request_type == 'retry' and self.degraded('no_retries'):
+            self.stats.inc_value('proxycrawl/budget/skipped_retries')
+            raise BudgetSkippedRequest("Credit budget: not retrying {}".format(request.original_url))
+        if request_type == 'details_page' and self.degraded('no_details'):
+            self.stats.inc_value('proxycrawl/budget/skipped_details')
+            raise BudgetSkippedRequest("Credit budget: skipping details of {}".format(request.original_url))
+        if request.screenshot and self.degraded('no_screenshots'):
+            self.stats.inc_value('proxycrawl/budget/skipped_screenshots')
+            # From the original url, so ProxyCrawlMiddleware builds the API url again without screenshot
+            return request.replace(url=request.original_url, screenshot=False, dont_filter=True)
+        return None
+
+    def process_response(self, request, response, spider):
+        if not isinstance(request, ProxyCrawlRequest):
+            return response
+        credits = self.credits(request)
+        request_type = self.request_type(request)
+        self.spent += credits
+        self.stats.inc_value('proxycrawl/requests')
+        self.stats.inc_value('proxycrawl/requests/{}'.format(request_type))
+        self.stats.inc_value('proxycrawl/credits', credits)
+        self.stats.inc_value('proxycrawl/credits/{}'.format(request_type), credits)
+
+        if self.budget and self.spent >= self.budget and not self.closing:
+            self.closing = True
+            logger.error("ProxyCrawl credit budget of {} exhausted, closing spider".format(self.budget))
+            self.crawler.engine.close_spider(spider, 'credit_budget_exceeded')
+        return response
+
+    def spider_closed(self, spider):
+        projected = self.projected()
+        self.stats.set_value('proxycrawl/projected_credits', projected)
+        logger.info("Spent {:.0f} ProxyCrawl credits (projected for the whole run: {:.0f})".format(
+            self.spent, projected))
@@ -4,8 +4,507 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+import gzip
+import hashlib
+import json
+import logging
+import re
+import time
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy_proxycrawl import ProxyCrawlRequest
+from twisted.internet import defer, threads
+
+from zillow_scraper.storage import read_bytes, uri_params, write_bytes
+
+logger = logging.getLogger(__name__)
+
+# Display string field -> typed companion column filled by NormalizationPipeline
+NORMALIZED_FIELDS = {
+    'price': 'price_value',
+    'number_of_bedrooms': 'number_of_bedrooms_value',
+    'number_of_bathrooms': 'number_of_bathrooms_value',
+    'sqft': 'sqft_value',
+    'property_taxes_last_year': 'property_taxes_last_year_value',
+    'estimated_monthly_cost': 'estimated_monthly_cost_value',
+    'property_taxes_monthly': 'property_taxes_monthly_value',
+    'hoa_fees': 'hoa_fees_value',
+    'zestimate_sell_price': 'zestimate_sell_price_value',
+    'zestimate_rent_price': 'zestimate_rent_price_value',
+    'elementary_school_rating': 'elementary_school_rating_value',
+    'middle_school_rating': 'middle_school_rating_value',
+    'high_school_rating': 'high_school_rating_value',
+}
+
+# First number in a display string like "$1,250,000", "$2.1M", "1,500 sqft", "0.28 acres lot", "$250/mo"
+# or "7/10", and the word right after it
+NUMBER_RE = re.compile(r'(\d[\d,]*(?:\.\d+)?|\.\d+)\s*([a-zA-Z]+)?')
+# Word after the number -> multiplier, areas are in square feet
+MULTIPLIERS = {'k': 1e3, 'm': 1e6, 'ac': 43560.0, 'acre': 43560.0, 'acres': 43560.0}
+
+
+def parse_number(value):
+    """Parse a Zillow display string into a float, None if there is no number in it"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = NUMBER_RE.search(value)
+    if match is None:
+        return None
+    number = float(match.group(1).replace(',', ''))
+    unit = match.group(2)
+    if unit:
+        number *= MULTIPLIERS.get(unit.lower(), 1)
+    return number
+
+
+# Link to an agent or school page -> field receiving the details parsed by EnrichmentPipeline
+ENRICHED_FIELDS = {
+    'listing_provider_link': 'listing_provider_details',
+    'elementary_school_link': 'elementary_school_details',
+    'middle_school_link': 'middle_school_details',
+    'high_school_link': 'high_school_details',
+}
+# Keys kept from the schema.org JSON-LD data of agent and school pages
+ENTITY_KEYS = ('@type', 'name', 'telephone', 'address', 'aggregateRating', 'url')
+
+# City and ZIP code at the end of an address like "123 Main St, Springfield, IL 62701"
+ADDRESS_RE = re.compile(r',\s*([^,]+?)\s*,\s*[A-Z]{2}\s+(\d{5})(?:-\d{4})?\s*$')
+
+# Zillow id of a home in its details link, like /homedetails/123-Main-St/12345678_zpid/
+ZPID_RE = re.compile(r'/(\d+)_zpid')
+
+
+def get_zpid(item):
+    link = item.get('home_details_link') or ''
+    match = ZPID_RE.search(link)
+    if match is None:
+        return link.split('?')[0] or None  # Best effort, the link without search params is unique too
+    return match.group(1)
+
+
+def partition_value(value):
+    # Safe for a path, e.g. "House for sale" -> "house-for-sale"
+    value = re.sub(r'[^a-z0-9]+', '-', (value or '').lower()).strip('-')
+    return value or 'unknown'
+
+
+def parse_entity_page(response):
+    """Details of an agent or school page, from its title and schema.org JSON-LD data"""
+    details = {'title': response.css('title::text').get()}
+    for script in response.css('script[type="application/ld+json"]::text').extract():
+        try:
+            data = json.loads(script)
+        except ValueError:
+            continue
+        if isinstance(data, list):
+            data = data[0] if data else {}
+        if isinstance(data, dict):
+            details.update((key, data[key]) for key in ENTITY_KEYS if key in data)
+            break
+    return details
 
 
 class ZillowScraperPipeline(object):
     def process_item(self, item, spider):
         return item
+
+
+class NormalizationPipeline(object):
+    """
+    Parses the price, fee, area and rating strings of each item into the typed ``*_value``
+    companion fields, before the item reaches the feed exporter.
+
+    Listings of a search repeat the same strings (ratings, fees, round prices), so parsed strings are
+    cached, up to NORMALIZATION_CACHE_SIZE of them. Items are never held back: a pending item keeps
+    its response in the scraper slot, and enough of them stop the engine from scheduling downloads.
+    """
+
+    def __init__(self, cache_size=10000, stats=None):
+        self.cache_size = cache_size
+        self.stats = stats
+        self.cache = {}  # display string -> parsed number
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('NORMALIZATION_ENABLED', True):
+            raise NotConfigured
+        return cls(cache_size=settings.getint('NORMALIZATION_CACHE_SIZE', 10000), stats=crawler.stats)
+
+    def process_item(self, item, spider):
+        started = time.time()
+        self.normalize(item)
+        if self.stats:
+            self.stats.inc_value('normalization/items')
+            self.stats.inc_value('normalization/seconds', time.time() - started)
+        return item
+
+    def normalize(self, item):
+        for field, value_field in NORMALIZED_FIELDS.items():
+            value = item.get(field)
+            try:
+                item[value_field] = self.cache[value]
+            except KeyError:
+                if len(self.cache) >= self.cache_size:
+                    self.cache.clear()
+                item[value_field] = self.cache[value] = parse_number(value)
+            except TypeError:  # Not hashable, e.g. a list from a bad selector
+                item[value_field] = None
+        return item
+
+
+class ChangeCapturePipeline(object):
+    """
+    Compares each listing with the previous run of the same search and writes a delta feed of
+    new, removed and changed listings (with old and new values of the changed fields).
+
+    The previous run is kept as one fingerprint per zpid at CHANGE_CAPTURE_STATE_URI: a digest of
+    all FEED_EXPORT_FIELDS values, so unchanged listings cost a single comparison, plus the values
+    themselves to report what changed. The delta feed is written to CHANGE_CAPTURE_URI as gzipped
+    JSON lines.
+
+    A listing is removed when its card is missing from the search results, not when its details could
+    not be fetched or were skipped by the credit budget: those keep their previous fingerprint. Removals and fingerprints are only stored when
+    the run went through every results page and finished normally, a run closed early (credit budget,
+    shutdown) or missing results pages would report the listings it didn't see as removed.
+    """
+
+    def __init__(self, settings, fields):
+        self.settings = settings
+        self.fields = fields
+        self.state_uri = settings.get('CHANGE_CAPTURE_STATE_URI')
+        self.changes_uri = settings.get('CHANGE_CAPTURE_URI')
+        self.stats = None
+        self.previous = {}
+        self.current = {}
+        self.seen = set()  # zpids of the listing cards in the search results
+        self.changes = []
+        self.finished = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CHANGE_CAPTURE_ENABLED'):
+            raise NotConfigured
+        pipeline = cls(settings, settings.getlist('FEED_EXPORT_FIELDS'))
+        pipeline.stats = crawler.stats
+        crawler.signals.connect(pipeline.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(pipeline.spider_idle, signal=signals.spider_idle)
+        return pipeline
+
+    def request_scheduled(self, request, spider):
+        # Every listing card gets a home details request, whether or not its details are then scraped
+        if getattr(request.callback, '__name__', None) == 'parse_home_details':
+            zpid = get_zpid(request.cb_kwargs['item'])
+            if zpid is not None:
+                self.seen.add(zpid)
+
+    def spider_idle(self, spider):
+        # Nothing left to crawl, the spider closes as finished. Never sent to a spider closed early
+        self.finished = True
+
+    def _complete(self):
+        pages = self.stats.get_value('zillow/pages')
+        return self.finished and pages is not None and self.stats.get_value('zillow/results_pages', 0) >= pages
+
+    def open_spider(self, spider):
+        self.state_uri = self.state_uri % uri_params(spider)
+        self.changes_uri = self.changes_uri % uri_params(spider)
+        return threads.deferToThread(self._load_state)
+
+    def _load_state(self):
+        data = read_bytes(self.state_uri, self.settings)
+        if data is None:
+            logger.info("No previous fingerprints in {}, every listing is new".format(self.state_uri))
+            return
+        state = json.loads(gzip.decompress(data).decode('utf-8'))
+        # Fields may have been added or removed since the previous run, compare by name
+        fields = state['fields']
+        for zpid, (digest, values) in state['listings'].items():
+            self.previous[zpid] = (digest, dict(zip(fields, values)))
+
+    def _fingerprint(self, item):
+        values = [item.get(field) for field in self.fields]
+        digest = hashlib.sha1(json.dumps(values, default=str).encode('utf-8')).hexdigest()[:16]
+        return digest, values
+
+    def process_item(self, item, spider):
+        zpid = get_zpid(item)
+        if zpid is None:
+            return item
+        self.seen.add(zpid)
+        if item.get('details_skipped'):
+            # Card data only, comparing it would report every details field as changed
+            if self.stats:
+                self.stats.inc_value('changecapture/details_skipped')
+            return item
+        digest, values = self._fingerprint(item)
+        self.current[zpid] = (digest, values)
+
+        previous = self.previous.get(zpid)
+        if previous is None:
+            self._add_change(zpid, 'new', values=dict(zip(self.fields, values)))
+        elif previous[0] != digest:
+            old_values = previous[1]
+            changes = {}
+            for field, value in zip(self.fields, values):
+                if old_values.get(field) != value:
+                    changes[field] = [old_values.get(field), value]
+            if changes:  # A digest mismatch with equal values means FEED_EXPORT_FIELDS changed
+                self._add_change(zpid, 'changed', changes=changes)
+        elif self.stats:
+            self.stats.inc_value('changecapture/unchanged')
+        return item
+
+    def _add_change(self, zpid, change, **data):
+        data['zpid'] = zpid
+        data['change'] = change
+        self.changes.append(data)
+        if self.stats:
+            self.stats.inc_value('changecapture/{}'.format(change))
+
+    def close_spider(self, spider):
+        store_state = False
+        if getattr(spider, 'sample_mode', False):
+            # A sample only sees a few listings, they would all look removed and replace the fingerprints
+            logger.info("SAMPLE MODE ON, NOT STORING FINGERPRINTS NOR REMOVED LISTINGS")
+        elif not self._complete():
+            logger.warning("Run closed early or missed results pages, not storing fingerprints nor removed listings")
+        else:
+            store_state = True
+            for zpid in set(self.previous) - self.seen:
+                self._add_change(zpid, 'removed', values=self.previous[zpid][1])
+            for zpid in self.seen - set(self.current):
+                # Listed but its details failed, keep comparing with the last values scraped
+                if zpid in self.previous:
+                    digest, old_values = self.previous[zpid]
+                    self.current[zpid] = (digest, [old_values.get(field) for field in self.fields])
+                    if self.stats:
+                        self.stats.inc_value('changecapture/carried_forward')
+        return threads.deferToThread(self._store, store_state)
+
+    def _store(self, store_state):
+        lines = [json.dumps(change, default=str) for change in self.changes]
+        write_bytes(self.changes_uri, gzip.compress('\n'.join(lines).encode('utf-8')), self.settings)
+        logger.info("Stored {} listing changes in {}".format(len(lines), self.changes_uri))
+        if store_state:
+            state = {'fields': self.fields, 'listings': self.current}
+            data = gzip.compress(json.dumps(state, default=str).encode('utf-8'))
+            write_bytes(self.state_uri, data, self.settings)
+
+
+class EnrichmentPipeline(object):
+    """
+    Follows the agent and school links of each item and adds the details of those pages.
+
+    Listings of a search share the same few schools and agents, so each url is fetched once per run:
+    items asking for a url already being downloaded wait on that same download, and results are kept
+    in a memo cache, optionally persisted at ENRICHMENT_CACHE_URI to be reused by the next runs.
+    A failed download only leaves the items waiting for it without details: the next item asking
+    for the url fetches it again, until it failed ENRICHMENT_MAX_FAILURES times in the run.
+    """
+
+    def __init__(self, crawler, cache_uri=None, max_failures=3):
+        self.crawler = crawler
+        self.settings = crawler.settings
+        self.stats = crawler.stats
+        self.cache_uri = cache_uri
+        self.max_failures = max_failures
+        self.cache = {}  # url -> details, None once the url failed max_failures times
+        self.failures = {}  # url -> failed downloads
+        self.pending = {}  # url -> deferreds of the items waiting for its download
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('ENRICHMENT_ENABLED'):
+            raise NotConfigured
+        return cls(
+            crawler,
+            cache_uri=crawler.settings.get('ENRICHMENT_CACHE_URI'),
+            max_failures=crawler.settings.getint('ENRICHMENT_MAX_FAILURES', 3),
+        )
+
+    def open_spider(self, spider):
+        if self.cache_uri:
+            self.cache_uri = self.cache_uri % uri_params(spider)
+            return threads.deferToThread(self._load_cache)
+
+    def _load_cache(self):
+        data = read_bytes(self.cache_uri, self.settings)
+        if data is not None:
+            self.cache.update(json.loads(gzip.decompress(data).decode('utf-8')))
+            logger.info("Loaded {} cached agent and school pages".format(len(self.cache)))
+
+    def close_spider(self, spider):
+        if self.cache_uri:
+            return threads.deferToThread(self._store_cache)
+
+    def _store_cache(self):
+        # Failed downloads are retried in the next run
+        cache = dict((url, details) for url, details in self.cache.items() if details is not None)
+        write_bytes(self.cache_uri, gzip.compress(json.dumps(cache).encode('utf-8')), self.settings)
+
+    def process_item(self, item, spider):
+        dfds = []
+        for link_field, details_field in ENRICHED_FIELDS.items():
+            link = item.get(link_field)
+            if not link:
+                continue
+            dfd = self.fetch(urljoin(spider.BASE_URL, link), spider)
+            dfd.addCallback(self._set_details, item, details_field)
+            dfds.append(dfd)
+        if not dfds:
+            return item
+        return defer.DeferredList(dfds).addCallback(lambda _: item)
+
+    def _set_details(self, details, item, details_field):
+        item[details_field] = details
+
+    def fetch(self, url, spider):
+        """Details of the page at url, sharing a single download between every item asking for it"""
+        if url in self.cache:
+            self.stats.inc_value('enrichment/cache_hits')
+            return defer.succeed(self.cache[url])
+
+        waiter = defer.Deferred()
+        if url in self.pending:  # Already in flight
+            self.stats.inc_value('enrichment/coalesced')
+            self.pending[url].append(waiter)
+            return waiter
+
+        self.pending[url] = [waiter]
+        self.stats.inc_value('enrichment/requests')
+        request = ProxyCrawlRequest(
+            url,
+            dont_filter=True,
+            user_agent=spider._get_random_user_agent(),
+            country='US',
+        )
+        dfd = self.crawler.engine.download(request, spider)
+        dfd.addCallback(self._parse_page, url)
+        dfd.addErrback(self._fetch_failed, url)
+        dfd.addCallback(self._fetched, url)
+        return waiter
+
+    def _parse_page(self, response, url):
+        # engine.download skips HttpErrorMiddleware, error pages must not be cached as details
+        pc_status = response.headers.get('pc_status', b'200')
+        if response.status != 200 or pc_status != b'200':
+            logger.warning("Could not get details from {}: status {}, ProxyCrawl status {}".format(
+                url, response.status, pc_status.decode('latin-1')))
+            self.stats.inc_value('enrichment/failed')
+            return None
+        return parse_entity_page(response)
+
+    def _fetch_failed(self, failure, url):
+        logger.warning("Could not get details from {}: {}".format(url, failure.getErrorMessage()))
+        self.stats.inc_value('enrichment/failed')
+        return None
+
+    def _fetched(self, details, url):
+        if details is not None:
+            self.cache[url] = details
+        else:
+            self.failures[url] = self.failures.get(url, 0) + 1
+            if self.failures[url] >= self.max_failures:
+                self.cache[url] = None  # Give up for this run, not persisted so the next run tries again
+        for waiter in self.pending.pop(url):
+            waiter.callback(details)
+
+
+class PartitionedOutputPipeline(object):
+    """
+    Writes items to one set of gzipped json lines files per ZIP code or city (and optionally per
+    listing type), so consumers only download the partitions they need.
+
+    Each partition is buffered up to PARTITION_FILE_ITEMS items and written as soon as it fills,
+    rolling to a new file, under PARTITION_URI/<partition>/part-NNNNN.jsonl.gz. A manifest.json
+    listing the files and item counts of every partition is written at spider close.
+    """
+
+    def __init__(self, settings, fields):
+        self.settings = settings
+        self.fields = fields
+        self.uri = settings.get('PARTITION_URI')
+        self.partition_by = settings.get('PARTITION_BY', 'zip')
+        self.partition_by_type = settings.getbool('PARTITION_BY_TYPE')
+        self.file_items = settings.getint('PARTITION_FILE_ITEMS', 1000)
+        self.max_buffered_items = settings.getint('PARTITION_MAX_BUFFERED_ITEMS', 10000)
+        self.stats = None
+        self.buffers = {}  # partition -> json lines not written yet
+        self.buffered_items = 0
+        self.partitions = {}  # partition -> {'items': count, 'files': [file names]}
+        self.writes = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('PARTITION_ENABLED'):
+            raise NotConfigured
+        if settings.get('PARTITION_BY', 'zip') not in ('zip', 'city'):
+            raise NotConfigured("PARTITION_BY must be zip or city")
+        pipeline = cls(settings, settings.getlist('FEED_EXPORT_FIELDS'))
+        pipeline.stats = crawler.stats
+        return pipeline
+
+    def open_spider(self, spider):
+        self.uri = self.uri.rstrip('/') % uri_params(spider)
+
+    def partition(self, item):
+        match = ADDRESS_RE.search(item.get('address') or '')
+        if match is None:
+            key = 'unknown'
+        else:
+            key = match.group(2) if self.partition_by == 'zip' else partition_value(match.group(1))
+        partition = '{}={}'.format(self.partition_by, key)
+        if self.partition_by_type:
+            partition += '/type={}'.format(partition_value(item.get('type')))
+        return partition
+
+    def process_item(self, item, spider):
+        partition = self.partition(item)
+        values = dict((field, item.get(field)) for field in self.fields)
+        self.buffers.setdefault(partition, []).append(json.dumps(values, default=str))
+        self.buffered_items += 1
+        if len(self.buffers[partition]) >= self.file_items:
+            self.write(partition)
+        elif self.buffered_items >= self.max_buffered_items:
+            # Many partitions filling slowly, free memory by writing the largest one early
+            self.write(max(self.buffers, key=lambda p: len(self.buffers[p])))
+        return item
+
+    def write(self, partition):
+        lines = self.buffers.pop(partition)
+        self.buffered_items -= len(lines)
+        info = self.partitions.setdefault(partition, {'items': 0, 'files': []})
+        name = '{}/part-{:05d}.jsonl.gz'.format(partition, len(info['files']))
+        info['items'] += len(lines)
+        info['files'].append(name)
+        if self.stats:
+            self.stats.inc_value('partitions/files')
+        data = gzip.compress('\n'.join(lines).encode('utf-8'))
+        self.writes.append(threads.deferToThread(write_bytes, '{}/{}'.format(self.uri, name), data, self.settings))
+
+    def close_spider(self, spider):
+        for partition in list(self.buffers):
+            self.write(partition)
+        # Manifest last, once every file it lists is written
+        dfd = defer.DeferredList(self.writes, fireOnOneErrback=True, consumeErrors=True)
+        dfd.addCallback(lambda _: threads.deferToThread(self._write_manifest))
+        return dfd
+
+    def _write_manifest(self):
+        manifest = {
+            'partition_by': [self.partition_by] + (['type'] if self.partition_by_type else []),
+            'fields': self.fields,
+            'partitions': self.partitions,
+        }
+        write_bytes(self.uri + '/manifest.json', json.dumps(manifest, indent=2).encode('utf-8'), self.settings)
+        logger.info("Wrote {} partitions in {}".format(len(self.partitions), self.uri))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Sampling profiler of the crawl, enabled with run_scraper.py --profile
+#
+# A background thread samples the stack of the reactor thread every PROFILE_INTERVAL seconds.
+# Nothing is traced, the only cost is one stack walk per interval, so it can stay on in production.
+# At spider close the samples are written to PROFILE_URI as:
+# - <uri>.folded: collapsed stacks, for flamegraph.pl or speedscope
+# - <uri>.txt: time per spider callback, field extractor, pipeline stage, item export, html
+#   parsing and reactor wait, and the top functions where time is spent
+
+import collections
+import inspect
+import logging
+import os
+import sys
+import threading
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import threads
+
+from zillow_scraper.storage import uri_params, write_bytes
+
+logger = logging.getLogger(__name__)
+
+# Modules whose classes get "Class.method" names in the reports
+PROJECT_MODULES = (
+    'zillow_scraper.spiders.zillow_spider',
+    'zillow_scraper.pipelines',
+    'zillow_scraper.middlewares',
+    'zillow_scraper.feedexport',
+    'zillow_scraper.archive',
+)
+SPIDER_CALLBACKS = ('parse', 'parse_listing_page', 'parse_listing_item', 'parse_home_details', 'error_handler')
+# Innermost Python frames of a reactor waiting for network events
+REACTOR_WAIT = ('doPoll', 'doSelect', 'doKEvent', 'doWaitForMultipleEvents')
+EXPORT_MODULES = ('exporters.py', 'feedexport.py')
+
+
+class StackSampler(threading.Thread):
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='zillow-profiler')
+        self.daemon = True
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()  # tuples of code objects, innermost first -> samples
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(stack)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def project_names():
+    """Code object -> "Class.method" for the methods of the project classes"""
+    names = {}
+    for module_name in PROJECT_MODULES:
+        module = sys.modules.get(module_name)
+        if module is None:
+            continue
+        for cls_name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module_name:
+                continue
+            for name, function in vars(cls).items():
+                function = getattr(function, '__func__', function)  # classmethods
+                code = getattr(function, '__code__', None)
+                if code is not None:
+                    names[code] = '{}.{}'.format(cls_name, name)
+    return names
+
+
+class CallbackProfiler(object):
+    """Extension sampling where the crawl spends its time, see the module comment"""
+
+    def __init__(self, crawler):
+        self.settings = crawler.settings
+        self.stats = crawler.stats
+        self.uri = self.settings.get('PROFILE_URI')
+        self.interval = self.settings.getfloat('PROFILE_INTERVAL', 0.01)
+        self.top = self.settings.getint('PROFILE_TOP', 30)
+        self.sampler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('PROFILE_ENABLED'):
+            raise NotConfigured
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.uri = self.uri % uri_params(spider)
+        # Signals are sent from the reactor thread, which runs every callback and pipeline
+        self.sampler = StackSampler(threading.get_ident(), self.interval)
+        self.sampler.start()
+
+    def spider_closed(self, spider):
+        self.sampler.stop()
+        names = project_names()
+        folded = self.folded(self.sampler.stacks, names)
+        summary = self.summary(self.sampler.stacks, names)
+        self.stats.set_value('profile/samples', sum(self.sampler.stacks.values()))
+        logger.info("Profile of the crawl:\n{}".format(summary))
+        return threads.deferToThread(self._store, folded, summary)
+
+    def _store(self, folded, summary):
+        write_bytes(self.uri + '.folded', folded.encode('utf-8'), self.settings)
+        write_bytes(self.uri + '.txt', summary.encode('utf-8'), self.settings)
+
+    def name(self, code, names):
+        if code in names:
+            return names[code]
+        return '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+
+    def category(self, code, names):
+        """Report line the time spent in this code counts for, None if it has none of its own"""
+        name = names.get(code)
+        if name is not None:
+            cls_name, _, method = name.partition('.')
+            if cls_name == 'ZillowSpider':
+                if method in SPIDER_CALLBACKS:
+                    return 'callback ' + name
+                if method.startswith('_parse_') or method == '_get_element':
+                    return 'field extractor ' + name
+            elif method in ('process_item', 'normalize', 'close_spider'):
+                return 'pipeline ' + name
+        if os.path.basename(code.co_filename) in EXPORT_MODULES and code.co_name in ('export_item', 'finish_exporting'):
+            return 'item export ' + code.co_name
+        return None
+
+    def folded(self, stacks, names):
+        # One "outermost;...;innermost count" line per distinct stack
+        lines = []
+        for stack, count in stacks.items():
+            lines.append('{} {}'.format(';'.join(self.name(code, names) for code in reversed(stack)), count))
+        return '\n'.join(sorted(lines)) + '\n'
+
+    def summary(self, stacks, names):
+        total = sum(stacks.values()) or 1
+        inclusive = collections.Counter()  # categories, including the time in what they call
+        own = collections.Counter()  # innermost functions
+        for stack, count in stacks.items():
+            if stack[0].co_name in REACTOR_WAIT:
+                inclusive['reactor waiting for network'] += count
+            if any(code.co_name == 'create_root_node' for code in stack):
+                # A page is parsed by its first selector, so this is also in the time of the first field extractor
+                inclusive['html parsing'] += count
+            categories = set(self.category(code, names) for code in stack)
+            categories.discard(None)
+            for category in categories:
+                inclusive[category] += count
+            own[self.name(stack[0], names)] += count
+
+        def report(title, counter):
+            lines = [title]
+            for label, count in counter.most_common(self.top):
+                lines.append('{:>10.3f}s {:>6.1f}%  {}'.format(count * self.interval, 100.0 * count / total, label))
+            return lines
+
+        lines = ['{} samples every {}s, about {:.1f}s of crawl'.format(total, self.interval, total * self.interval)]
+        lines += report('\nTime by callback, field extractor, pipeline stage and export (inclusive):', inclusive)
+        lines += report('\nTop {} functions (self time):'.format(self.top), own)
+        return '\n'.join(lines) + '\n'
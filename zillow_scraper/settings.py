@@ -77,16 +77,39 @@ PROXYCRAWL_ENABLED = True
 # The ProxyCrawl API token you wish to use, either normal of javascript token
 PROXYCRAWL_TOKEN = os.environ.get('PROXYCRAWL_TOKEN')
 
+# ProxyCrawl API url, changed by the load tests to use a local mock
+PROXYCRAWL_URL = 'https://api.proxycrawl.com'
+
 # Enable or disable downloader middlewares
 DOWNLOADER_MIDDLEWARES = {
-    'scrapy_proxycrawl.ProxyCrawlMiddleware': 610 # For ProxyCrawl
+    'zillow_scraper.middlewares.ProxyCrawlCostMiddleware': 600,  # Before ProxyCrawl builds the API url
+    'zillow_scraper.middlewares.ProxyCrawlMiddleware': 610 # For ProxyCrawl
+}
+
+# ProxyCrawl credits of a request, plus the extra credits for javascript rendering and screenshots
+PROXYCRAWL_CREDITS_PER_REQUEST = 1
+PROXYCRAWL_CREDITS_JAVASCRIPT = 1
+PROXYCRAWL_CREDITS_SCREENSHOT = 1
+# Maximum credits a run may spend, 0 for no budget
+PROXYCRAWL_CREDIT_BUDGET = 0
+# Share of the budget spent at which each degradation starts. Screenshots also stop as soon as the
+# projected cost of the run goes over budget. The spider is closed when the whole budget is spent.
+PROXYCRAWL_BUDGET_STEPS = {
+    'no_screenshots': 0.5,
+    'no_retries': 0.8,
+    'no_details': 0.95,
 }
 
 DNSCACHE_ENABLED = False  # For ProxyCrawl
 
-# Export results to excel
+# Export results to excel, openpyxl is imported on the first exported item
 FEED_EXPORTERS = {
-    'xlsx': 'scrapy_xlsx.XlsxItemExporter',
+    'xlsx': 'zillow_scraper.feedexport.LazyXlsxItemExporter',
+}
+
+# Store results in S3, the botocore client is created when the feed is stored
+FEED_STORAGES = {
+    's3': 'zillow_scraper.feedexport.LazyS3FeedStorage',
 }
 
 # Storage settings for S3
@@ -95,15 +118,66 @@ AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-#}
+EXTENSIONS = {
+    'zillow_scraper.archive.ResponseArchive': 500,
+    'zillow_scraper.profiling.CallbackProfiler': 500,
+}
+
+# Archive the raw home details pages to parse them again later with reparse.py, without fetching them.
+# Compressed with zstd and a dictionary trained on the first pages of each run.
+ARCHIVE_ENABLED = False
+ARCHIVE_URI = 's3://scraperant-prod/scraping/archive'
+# Pages used to train the compression dictionary of each run, and its size in bytes
+ARCHIVE_DICTIONARY_SAMPLES = 32
+ARCHIVE_DICTIONARY_SIZE = 112640
+
+# Sample where the crawl spends its time, also enabled with run_scraper.py --profile
+PROFILE_ENABLED = False
+# Flamegraph stacks and summary are written to PROFILE_URI.folded and PROFILE_URI.txt
+PROFILE_URI = 's3://scraperant-prod/scraping/profiles/%(time)s_%(name)s_%(search)s'
+# Seconds between samples, and number of lines in each table of the summary
+PROFILE_INTERVAL = 0.01
+PROFILE_TOP = 30
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    'zillow_scraper.pipelines.ZillowScraperPipeline': 300,
-#}
+ITEM_PIPELINES = {
+    'zillow_scraper.pipelines.EnrichmentPipeline': 200,
+    'zillow_scraper.pipelines.NormalizationPipeline': 300,
+    'zillow_scraper.pipelines.ChangeCapturePipeline': 400,
+    'zillow_scraper.pipelines.PartitionedOutputPipeline': 500,
+}
+
+# Add details of the agent and school pages, each page is fetched once per run
+ENRICHMENT_ENABLED = False
+# Optionally keep fetched pages details between runs, e.g. 's3://scraperant-prod/scraping/state/enrichment_cache.json.gz'
+ENRICHMENT_CACHE_URI = None
+# Failed downloads of a page before it is left without details for the rest of the run
+ENRICHMENT_MAX_FAILURES = 3
+
+# Parse prices, taxes, fees, areas and ratings into the typed *_value columns
+NORMALIZATION_ENABLED = True
+# Distinct display strings kept parsed, listings of a search repeat most of them
+NORMALIZATION_CACHE_SIZE = 10000
+
+# Emit a delta feed of new, removed and changed listings since the previous run of the same search
+CHANGE_CAPTURE_ENABLED = False
+# Fingerprints of the previous run, %(search)s is a short hash of the zillow url
+CHANGE_CAPTURE_STATE_URI = 's3://scraperant-prod/scraping/state/%(name)s_%(search)s_fingerprints.json.gz'
+CHANGE_CAPTURE_URI = 's3://scraperant-prod/scraping/feeds/%(time)s_%(name)s_changes.jsonl.gz'
+# Also export the full xlsx snapshot, set to False to export the delta feed only
+CHANGE_CAPTURE_SNAPSHOT = True
+
+# Also write the items partitioned by ZIP code or city of their address, one set of files per partition
+PARTITION_ENABLED = False
+PARTITION_URI = 's3://scraperant-prod/scraping/partitions/%(time)s_%(name)s_%(search)s'
+PARTITION_BY = 'zip'  # or 'city'
+# Split each partition by listing type too
+PARTITION_BY_TYPE = False
+# Items per file, a partition file is written as soon as it is full
+PARTITION_FILE_ITEMS = 1000
+# Items kept in memory over all partitions before the largest one is written early
+PARTITION_MAX_BUFFERED_ITEMS = 10000
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
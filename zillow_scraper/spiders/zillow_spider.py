@@ -12,6 +12,7 @@ from twisted.internet.error import DNSLookupError
 from twisted.internet.error import TimeoutError, TCPTimedOutError
 from scrapy.spiders import Spider
 from zillow_scraper.items import HomeItem
+from zillow_scraper.middlewares import BudgetSkippedRequest
 
 
 class ZillowSpider(Spider):
@@ -46,9 +47,36 @@ class ZillowSpider(Spider):
             "high_school_name",
             "high_school_rating",
             "high_school_link",
+            # Typed companion columns filled by NormalizationPipeline
+            "price_value",
+            "number_of_bedrooms_value",
+            "number_of_bathrooms_value",
+            "sqft_value",
+            "property_taxes_last_year_value",
+            "estimated_monthly_cost_value",
+            "property_taxes_monthly_value",
+            "hoa_fees_value",
+            "zestimate_sell_price_value",
+            "zestimate_rent_price_value",
+            "elementary_school_rating_value",
+            "middle_school_rating_value",
+            "high_school_rating_value",
+            "listing_provider_link",
+            # Filled by EnrichmentPipeline when enabled
+            "listing_provider_details",
+            "elementary_school_details",
+            "middle_school_details",
+            "high_school_details",
         ],
     }
 
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # Delta feed only, don't export the full snapshot
+        if settings.getbool('CHANGE_CAPTURE_ENABLED') and not settings.getbool('CHANGE_CAPTURE_SNAPSHOT'):
+            settings.set('FEED_URI', None, priority='spider')
+
     def __init__(self, name=None, **kwargs):
         super().__init__(name=None, **kwargs)
         self.start_urls = [self.zillow_url]
@@ -89,11 +117,12 @@ class ZillowSpider(Spider):
         pagination_links = self._get_pages(response)
         if len(pagination_links) == 0:
             print("NO PAGES FOUND..RETRY")
-            yield response.request.replace(dont_filter=True) # Trigger a new request
+            yield self._retry_request(response.request) # Trigger a new request
         else:
             if self.sample_mode:
                 logging.debug("SAMPLE MODE ON, PARSING ONLY FIRST PAGE..")
                 del pagination_links[1:]  # truncate to first link only
+            self.crawler.stats.set_value('zillow/pages', len(pagination_links))  # for the credits projection
             print("PARSING {} PAGES..".format(len(pagination_links)))
             for i, link in enumerate(pagination_links):
                 # Is a listing page different from page 1 like /houses/2_p/?
@@ -129,12 +158,20 @@ class ZillowSpider(Spider):
         if self.sample_mode:
             logging.debug("SAMPLE MODE ON, PARSING ONLY 3 LISTING ITEMS..")
             listings = listings[0:3]  # truncate to 3 items
+        self.crawler.stats.inc_value('zillow/results_pages')
+        self.crawler.stats.inc_value('zillow/cards', len(listings))
 
         # Parse each listing details
         for listing_item in listings:
             try:
                 # First get basic home data shown on the list
                 item = self.parse_listing_item(listing_item)
+                if self.crawler.stats.get_value('proxycrawl/budget/skipped_details'):
+                    # Over the credit budget for details pages (see ProxyCrawlCostMiddleware), keep the card data
+                    self.crawler.stats.inc_value('proxycrawl/budget/skipped_details')
+                    item['details_skipped'] = True
+                    yield item
+                    continue
 
                 # Then visit each home details page to get extra data
                 logging.debug("Getting {}".format(item['home_details_link']))
@@ -197,12 +234,13 @@ class ZillowSpider(Spider):
             ERROR_TEXT = "There was an error retrieving some of the data for this home"
             if ERROR_TEXT in response.text:
                 logging.warning("ERROR LOADING PAGE:\n {}\n RETRYING..".format(item['home_details_link']))
-                return response.request.replace(dont_filter=True)
+                return self._retry_request(response.request)
 
             # Extract data
             self._parse_listing_provided_by(response, item)
             self._parse_listing_provider_name(response, item)
             self._parse_listing_provider_phone(response, item)
+            self._parse_listing_provider_link(response, item)
             self._parse_property_taxes_last_year(response, item)
             self._parse_estimated_monthly_cost(response, item)
             self._parse_property_taxes_monthly(response, item)
@@ -341,6 +379,23 @@ class ZillowSpider(Spider):
             logging.warning("LISTING PROVIDER PHONE NOT FOUND:\n {}".format(item['home_details_link']))
         return item
 
+    def _parse_listing_provider_link(self, response, item):
+        # Profile page of the agent, owners don't have one
+        if item['listing_provided_by'] == 'owner':
+            item['listing_provider_link'] = None
+            return item
+        link = self._get_element(
+            response,
+            css_selectors=[
+                'a.ds-listing-agent-display-name::attr(href)',
+                'a.cf-listing-agent-display-name::attr(href)',
+                'div.cf-cnt-rpt-container:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > '
+                'span:nth-child(1) > a:nth-child(1)::attr(href)',
+            ]
+        )
+        item['listing_provider_link'] = response.urljoin(link) if link else None
+        return item
+
     def _parse_property_taxes_last_year(self, response, item):
         item['property_taxes_last_year'] = self._get_element(
             response,
@@ -525,6 +580,15 @@ class ZillowSpider(Spider):
         return proxied_url
 
     def error_handler(self, failure):
+        if failure.check(BudgetSkippedRequest):
+            # Not an error, the run is over its ProxyCrawl credit budget. Keep the listing card data
+            self.logger.info(failure.getErrorMessage())
+            item = failure.request.cb_kwargs.get('item')
+            if item is not None:
+                item['details_skipped'] = True
+                yield item
+            return
+
         # log all failures
         self.logger.error(repr(failure))
 
@@ -536,7 +600,7 @@ class ZillowSpider(Spider):
             # you can get the non-200 response
             response = failure.value.response
             self.logger.error('RETRYING HttpError on %s. ', response.url)
-            yield response.request.replace(dont_filter=True)
+            yield self._retry_request(response.request)
 
         elif failure.check(DNSLookupError):
             # this is the original request
@@ -547,6 +611,11 @@ class ZillowSpider(Spider):
             request = failure.request
             self.logger.error('TimeoutError on %s', request.url)
 
+    def _retry_request(self, request):
+        # Count retries in meta, so they can be told apart from first attempts (see ProxyCrawlCostMiddleware)
+        meta = dict(request.meta, spider_retries=request.meta.get('spider_retries', 0) + 1)
+        return request.replace(dont_filter=True, meta=meta)
+
     def _url_with_query_params(self, url, new_params=None):
         base_url = url.split('?')[0]  # Remove current params if present
         params = self.zillow_query_params
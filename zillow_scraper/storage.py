@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# Read and write whole files on the local disk or in S3
+#
+# Used for the small side outputs of a run (state files, indexes, extra feeds) that are not
+# items going through the feed exporter. Like feedexport.LazyS3FeedStorage, botocore is only
+# imported when an s3:// uri is actually used.
+
+import datetime
+import hashlib
+import io
+import os
+import shutil
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+
+def uri_params(spider, **params):
+    """Parameters available to %(...)s placeholders in output uris, as for FEED_URI"""
+    params.setdefault('name', spider.name)
+    params.setdefault('time', datetime.datetime.utcnow().replace(microsecond=0).isoformat().replace(':', '-'))
+    # Stable short key of the search, so state of different searches is kept apart
+    params.setdefault('search', hashlib.sha1(spider.zillow_url.encode('utf-8')).hexdigest()[:12])
+    return params
+
+
+def _s3_client(settings):
+    import botocore.session
+    session = botocore.session.get_session()
+    return session.create_client(
+        's3',
+        aws_access_key_id=settings['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=settings['AWS_SECRET_ACCESS_KEY']
+    )
+
+
+def read_bytes(uri, settings):
+    """Return the content of uri, None if it does not exist"""
+    u = urlparse(uri)
+    if u.scheme == 's3':
+        client = _s3_client(settings)
+        try:
+            return client.get_object(Bucket=u.hostname, Key=u.path[1:])['Body'].read()
+        except client.exceptions.NoSuchKey:
+            return None
+    path = u.path if u.scheme == 'file' else uri
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def write_bytes(uri, data, settings):
+    write_file(uri, io.BytesIO(data), settings)
+
+
+def write_file(uri, file, settings):
+    """Like write_bytes, streaming the content of an open file instead of holding it in memory"""
+    file.seek(0)
+    u = urlparse(uri)
+    if u.scheme == 's3':
+        kwargs = {'ACL': settings['FEED_STORAGE_S3_ACL']} if settings['FEED_STORAGE_S3_ACL'] else {}
+        _s3_client(settings).put_object(Bucket=u.hostname, Key=u.path[1:], Body=file, **kwargs)
+        return
+    path = u.path if u.scheme == 'file' else uri
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(file, f)
+
+
+def list_uris(uri, settings):
+    """Uris of every file under the uri "directory", recursively"""
+    u = urlparse(uri)
+    if u.scheme == 's3':
+        prefix = u.path[1:].rstrip('/') + '/'
+        paginator = _s3_client(settings).get_paginator('list_objects_v2')
+        uris = []
+        for page in paginator.paginate(Bucket=u.hostname, Prefix=prefix):
+            uris.extend('s3://{}/{}'.format(u.hostname, obj['Key']) for obj in page.get('Contents', []))
+        return uris
+    path = u.path if u.scheme == 'file' else uri
+    uris = []
+    for dirpath, _, filenames in os.walk(path):
+        uris.extend(os.path.join(dirpath, filename) for filename in filenames)
+    return sorted(uris)